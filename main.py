@@ -1,40 +1,56 @@
 import os
+import sys
 import time
-import json
-import random  # <-- IMPORTANT: Added for random delays
+import atexit
+import hashlib
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
+import numpy as np
+import orjson
 import pandas as pd
 import yfinance as yf
 import gspread
 import requests
 import google.generativeai as genai
 from email.mime.text import MIMEText
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# One pooled HTTP session shared by Yahoo and Telegram calls, so connections
+# (and their TLS handshakes) get reused instead of reopened every request.
+# 429s are NOT retried here - fetch_stock already backs off on rate limits,
+# and retrying at both layers would only hammer Yahoo harder.
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = 'Mozilla/5.0 (compatible; PortfolioRobot/1.0)'
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504]),
+))
 
 # ===============================
 # STEP 1: READ YOUR SPREADSHEET
 # ===============================
 print("Robot is reading your spreadsheet...")
 
-# Write service account credentials from env var to a file
-with open('credentials.json', 'w') as f:
-    json.dump(json.loads(os.environ["GCP_CREDENTIALS_JSON"]), f)
-
-# Authorize gspread with service account
-gc = gspread.service_account(filename='credentials.json')
+# Authorize gspread straight from the env var (no credentials file written to disk)
+creds = orjson.loads(os.environ["GCP_CREDENTIALS_JSON"])
+gc = gspread.service_account_from_dict(creds)
 
 # Open spreadsheet and worksheet
 SPREADSHEET_NAME = "PortfolioDB"
 SHEET_NAME = "Sheet1"
 worksheet = gc.open(SPREADSHEET_NAME).worksheet(SHEET_NAME)
 
-# Get all records (first row is treated as header)
-records = worksheet.get_all_records()
-portfolio = pd.DataFrame(records)
-
-# Clean column names (remove extra spaces, etc.)
-portfolio.columns = [c.strip() for c in portfolio.columns]
+# Get the raw cell grid in one call (first row is the header) and build the
+# DataFrame from it directly, cleaning column names (extra spaces, etc.) as we go
+values = worksheet.get_all_values()
+if not values:
+    raise ValueError(f"Sheet '{SHEET_NAME}' is empty.")
+portfolio = pd.DataFrame(values[1:], columns=[c.strip() for c in values[0]])
 
 # Sanity check: make sure required columns exist
 required_cols = {"Ticker", "Shares", "Avg_Cost"}
@@ -43,32 +59,32 @@ if missing:
     raise ValueError(f"Missing columns in sheet: {missing}. "
                      f"Current columns: {portfolio.columns.tolist()}")
 
+# Cells come back as text - convert the numeric columns once up front
+for col in ("Shares", "Avg_Cost"):
+    portfolio[col] = pd.to_numeric(portfolio[col], errors="coerce")
+
 print(f"Found {len(portfolio)} stocks in your portfolio")
 print("Columns detected:", portfolio.columns.tolist())
 
 # ===============================
 # STEP 2: GET STOCK DATA (Polite & Persistent)
 # ===============================
+# The only fundamentals we need for GARP scoring
+FUNDAMENTAL_KEYS = ("pegRatio", "returnOnEquity", "debtToEquity")
+
 def fetch_stock(ticker: str, max_retries=3):
     """
-    Fetches stock info from Yahoo Finance with retry logic and polite delays.
+    Fetches PEG / ROE / D/E for a stock from Yahoo Finance with retry logic and rate-limit backoff.
     """
     for attempt in range(max_retries):
         try:
             print(f"  Checking {ticker}... (Attempt {attempt + 1}/{max_retries})")
             
-            # Be EXTRA nice to Yahoo: wait 3-7 seconds randomly between requests
-            # This makes you look like a human, not a spammy bot
-            sleep_time = random.uniform(3, 7)
-            print(f"    ⏱️  Waiting {sleep_time:.1f} seconds to be polite...")
-            time.sleep(sleep_time)
-            
-            # Identify ourselves as a friendly robot (not a scraper)
-            stock = yf.Ticker(ticker)
-            stock.session.headers['User-Agent'] = 'Mozilla/5.0 (compatible; PortfolioRobot/1.0)'
+            # Shared session identifies us as a friendly robot (not a scraper)
+            stock = yf.Ticker(ticker, session=SESSION)
             
-            # Get the data
-            info = stock.info
+            # Get the data (fast_info doesn't carry PEG / ROE / D/E, so this needs the full info)
+            info = stock.get_info()
             
             # Check if we actually got real data (not empty)
             if not info or info.get('symbol') is None:
@@ -79,8 +95,9 @@ def fetch_stock(ticker: str, max_retries=3):
                     continue
                 else:
                     return None
-                
-            return info
+
+            # Keep only the fields we score on, not the whole blob
+            return {key: info.get(key) for key in FUNDAMENTAL_KEYS}
             
         except Exception as e:
             error_msg = str(e)
@@ -99,25 +116,37 @@ def fetch_stock(ticker: str, max_retries=3):
                 # Last attempt failed
                 return None
 
+def fnum(x, f=".2f", suffix="", scale=1):
+    """
+    Formats a number (Python or NumPy) for the report, or "N/A" if it's missing/NaN/inf.
+    """
+    return f"{x * scale:{f}}{suffix}" if x is not None and np.isfinite(x) else "N/A"
+
+# Collect the tickers to analyze
+tickers = [t for t in portfolio["Ticker"].astype(str).str.strip() if t]
+if not tickers:
+    raise RuntimeError("No tickers found to analyze. Check your sheet content.")
+
+# Fetch fundamentals for several stocks at once instead of one after another
+CONCURRENCY_LIMIT = 4  # max requests in flight - keeps Yahoo from rate limiting us
+with ThreadPoolExecutor(max_workers=CONCURRENCY_LIMIT) as executor:
+    fundamentals = dict(zip(tickers, executor.map(fetch_stock, tickers)))
+
 # Track how many stocks we successfully analyzed
 analysis_results = []
 successful_fetches = 0
 
-for _, row in portfolio.iterrows():
-    ticker = str(row["Ticker"]).strip()
-    if not ticker:
-        continue
-
-    info = fetch_stock(ticker)
+for ticker in tickers:
+    info = fundamentals[ticker]
 
     if info is None:
         analysis_results.append(f"**{ticker}**: ❌ ERROR - Could not get data")
         continue
 
     # Get the numbers with defaults
-    peg = info.get("pegRatio", None)
-    roe = info.get("returnOnEquity", None)
-    de_ratio = info.get("debtToEquity", None)
+    peg = info["pegRatio"]
+    roe = info["returnOnEquity"]
+    de_ratio = info["debtToEquity"]
 
     # Only score if we have real numbers (not None)
     score = 0
@@ -133,52 +162,49 @@ for _, row in portfolio.iterrows():
     status = status_list[min(score, 3)]
 
     # Safe formatting (avoid crashes if data is weird)
-    peg_str = f"{peg:.2f}" if isinstance(peg, (int, float)) else "N/A"
-    if isinstance(roe, (int, float)):
-        roe_pct_str = f"{roe * 100:.1f}%"
-    else:
-        roe_pct_str = "N/A"
-    de_str = f"{de_ratio:.1f}" if isinstance(de_ratio, (int, float)) else "N/A"
-
     analysis_results.append(
-        f"**{ticker}**: {status} | PEG: {peg_str} | ROE: {roe_pct_str} | D/E: {de_str}"
+        f"**{ticker}**: {status} | PEG: {fnum(peg)} | ROE: {fnum(roe, '.1f', '%', 100)}"
+        f" | D/E: {fnum(de_ratio, '.1f')}"
     )
     successful_fetches += 1
 
-# If no stocks could be analyzed, stop here with explanation
-if not analysis_results:
-    raise RuntimeError("No tickers found to analyze. Check your sheet content.")
-
 # ===============================
 # STEP 3: ASK THE AI BRAIN (CORRECT MODEL)
 # ===============================
 print("Asking AI to think...")
 
-# If all stocks failed, don't waste AI credits - send direct message
-if successful_fetches == 0:
-    ai_summary = """
-    <h2>🚨 Portfolio Robot Report</h2>
-    <p><strong>All stock data fetches failed.</strong></p>
-    <p>Yahoo Finance blocked every request due to rate limiting. This happens when:</p>
-    <ul>
-        <li>You have too many stocks (>5 is risky)</li>
-        <li>Yahoo is having a bad day (rare)</li>
-        <li>Your IP range is flagged (GitHub's IPs sometimes are)</li>
-    </ul>
-    <p><strong>What to do:</strong></p>
-    <ul>
-        <li>Wait 1 hour and try again</li>
-        <li>Temporarily reduce to 3-5 stocks in your sheet</li>
-        <li>The robot is already configured with maximum politeness</li>
-    </ul>
-    <p><em>Raw errors:</em> All tickers returned 429 Too Many Requests</p>
+# Where AI summaries are kept between runs (persisted by actions/cache in the
+# workflow). Entries older than a week are pruned so the folder doesn't grow forever.
+LLM_CACHE_DIR = Path("~/.cache/portfolio-robot/llm").expanduser()
+LLM_CACHE_MAX_AGE_DAYS = 7
+
+def prune_llm_cache():
+    """
+    Deletes cached AI summaries older than LLM_CACHE_MAX_AGE_DAYS.
     """
+    if not LLM_CACHE_DIR.exists():
+        return
+    cutoff = time.time() - LLM_CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+    for path in LLM_CACHE_DIR.glob("*.txt"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError as e:
+            print(f"    ⚠️  Could not prune {path.name}: {e}")
+
+prune_llm_cache()
+
+# Set up the model once; a missing/bad key only surfaces at generate_content()
+# below, where it falls back to the plain summary
+genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# ✅ CORRECT MODEL NAME FOR FREE TIER:
+model = genai.GenerativeModel("gemini-1.5-flash-latest")
+
+# If all stocks failed, don't waste AI credits (or notifications) - we bail out below
+if successful_fetches == 0:
+    ai_summary = "Portfolio Robot: all fetches failed (rate-limited). Skipping notifications."
 else:
     try:
-        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-        # ✅ CORRECT MODEL NAME FOR FREE TIER:
-        model = genai.GenerativeModel("gemini-1.5-flash-latest")
-
         # Build the prompt safely
         analysis_str = "\n".join(analysis_results)
         prompt = f"""You are my stock analyst. Here's my portfolio data:
@@ -191,20 +217,30 @@ Write a short email summary. Tell me:
 
 Keep it under 200 words."""
         
-        response = model.generate_content(prompt)
-        ai_summary = response.text
-        print("    ✅ AI responded successfully!")
+        # Same data as a previous run (weekends, holidays, reruns)? Reuse that summary
+        prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+        summary_path = LLM_CACHE_DIR / f"{prompt_hash}.txt"
+        if summary_path.exists():
+            ai_summary = summary_path.read_text()
+            print("    ♻️  Portfolio unchanged - reusing cached AI summary")
+        else:
+            response = model.generate_content(prompt)
+            ai_summary = response.text
+            print("    ✅ AI responded successfully!")
+            try:
+                LLM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                summary_path.write_text(ai_summary)
+            except OSError as e:
+                print(f"    ⚠️  Could not cache AI summary: {e}")
     except Exception as e:
         print(f"    ❌ AI error: {e}")
         # Fallback: Create a clean HTML summary without AI
+        stock_items = "\n".join(f"<li>{line}</li>" for line in analysis_results[:8])  # Show first 8 stocks
         ai_summary = f"""
         <h2>Daily GARP Analysis</h2>
         <p><strong>Successfully analyzed: {successful_fetches}/{len(portfolio)} stocks</strong></p>
         <ul>
-        """
-        for line in analysis_results[:8]:  # Show first 8 stocks
-            ai_summary += f"<li>{line}</li>"
-        ai_summary += """
+{stock_items}
         </ul>
         <p><em>AI summary unavailable. Using raw scores above.</em></p>
         """
@@ -212,6 +248,43 @@ Keep it under 200 words."""
 # ===============================
 # STEP 4: SEND EMAIL
 # ===============================
+def get_smtp():
+    """
+    Returns a logged-in Gmail SMTP connection, reusing the previous one if it is still alive.
+    """
+    server = getattr(get_smtp, "_srv", None)
+    if server is not None:
+        try:
+            # Cheap health check - anything but 250 (e.g. 421) means the server is closing on us
+            if server.noop()[0] == 250:
+                return server
+        except smtplib.SMTPServerDisconnected:
+            pass
+        print("    🔄 SMTP connection dropped, reconnecting...")
+        close_smtp()
+
+    server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+    try:
+        server.ehlo()
+        server.login(os.environ["EMAIL_USER"], os.environ["EMAIL_PASS"])
+    except Exception:
+        server.close()  # don't leak the socket if login fails
+        raise
+    get_smtp._srv = server
+    return server
+
+def close_smtp():
+    server = getattr(get_smtp, "_srv", None)
+    if server is None:
+        return
+    get_smtp._srv = None
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+atexit.register(close_smtp)
+
 def send_email():
     print("Sending email...")
     try:
@@ -222,9 +295,7 @@ def send_email():
         msg["From"] = os.environ["EMAIL_USER"]
         msg["To"] = os.environ["EMAIL_TO"]
 
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(os.environ["EMAIL_USER"], os.environ["EMAIL_PASS"])
-            server.send_message(msg)
+        get_smtp().send_message(msg)
 
         print("✅ Email sent!")
     except Exception as e:
@@ -233,6 +304,9 @@ def send_email():
 # ===============================
 # STEP 5: SEND TELEGRAM (ROBUST VERSION)
 # ===============================
+TELEGRAM_TEMPLATE = "<b>Daily Stock Report</b>\n\n{summary}\n\n{body}"
+TELEGRAM_BODY_LIMIT = 800  # chars of the AI summary to include
+
 def send_telegram():
     print("Sending Telegram message...")
     
@@ -250,17 +324,13 @@ def send_telegram():
         if successful_fetches < len(portfolio):
             summary_line += f" | {len(portfolio) - successful_fetches} failed ❌"
         
-        # Ensure we have content to send (never send empty message)
-        message_content = ai_summary if ai_summary else "No analysis generated."
-        if len(message_content) > 800:
-            message_content = message_content[:800] + "..."
-        
-        # Build final message
-        message = f"<b>Daily Stock Report</b>\n\n{summary_line}\n\n{message_content}"
+        # Ensure we have content to send (never send empty message); cap it with one slice
+        body = ai_summary[:TELEGRAM_BODY_LIMIT] if ai_summary else "No analysis generated."
+        if ai_summary and len(ai_summary) > TELEGRAM_BODY_LIMIT:
+            body += "..."
         
-        # Truncate if still too long (Telegram limit: 4096 chars)
-        if len(message) > 4000:
-            message = message[:3800] + "\n\n<i>...message truncated</i>"
+        # Build final message (capped body keeps it well under Telegram's 4096 char limit)
+        message = TELEGRAM_TEMPLATE.format(summary=summary_line, body=body)
 
         # ✅ FIXED: No space in URL
         url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
@@ -273,7 +343,12 @@ def send_telegram():
         # Log what we're sending (for debugging)
         print(f"    📤 Sending to Telegram: {len(message)} chars...")
         
-        resp = requests.post(url, json=payload, timeout=10)
+        resp = SESSION.post(
+            url,
+            data=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+            timeout=10,
+        )
         
         # Log Telegram's exact response
         print(f"    📥 Telegram response: {resp.status_code} - {resp.text}")
@@ -299,9 +374,15 @@ if __name__ == "__main__":
     print("\n" + "="*50)
     print("🤖 ROBOT STARTING DAILY ANALYSIS")
     print("="*50)
-    
-    send_email()
-    send_telegram()
+
+    # Yahoo is clearly blocking us - nothing worth sending, fail the run so CI shows it
+    if successful_fetches == 0:
+        print(f"❌ {ai_summary}")
+        sys.exit(2)
+
+    # Email and Telegram don't depend on each other - send both at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda send: send(), [send_email, send_telegram]))
     
     print("\n" + "="*50)
     print(f"✅ ROBOT FINISHED!")